@@ -7,7 +7,7 @@ setup(
     author="Zenkai Score Team",
     packages=find_packages(),
     install_requires=[
-        "torch>=1.7.0",
+        "torch>=1.13.0",
         "open-clip-torch>=2.0.0",
         "pillow>=7.0.0",
         "tqdm>=4.45.0",
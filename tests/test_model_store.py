@@ -0,0 +1,286 @@
+import hashlib
+import http.server
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from zenkai_score import model_store
+from zenkai_score.model_store import ModelStore, ModelStoreError, assign_state_dict
+
+DATA = bytes(range(256)) * 4096
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serves DATA, optionally truncated or ignoring Range requests"""
+
+    truncate_to = None
+    ignore_range = False
+    requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).requests += 1
+        start = 0
+        byte_range = self.headers.get("Range")
+        if byte_range and not self.ignore_range:
+            start = int(byte_range.split("=")[1].rstrip("-"))
+            if start >= len(DATA):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(DATA)}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(DATA) - 1}/{len(DATA)}")
+        else:
+            self.send_response(200)
+        body = DATA[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.truncate_to is not None:
+            body = body[:self.truncate_to]
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    handler = type("Handler", (_Handler,), {})
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_port}/w.bin"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ModelStore(root=tmp_path / "store", offline=False)
+
+
+def test_fetch_installs_with_digest(store, server):
+    _, url = server
+    path = store.fetch("w.bin", url=url, sha256=DIGEST)
+    assert path.read_bytes() == DATA
+    assert store.is_installed("w.bin")
+    assert store.verify("w.bin") == DIGEST
+    assert not path.with_name("w.bin.part").exists()
+
+
+def test_fetch_resumes_partial_download(store, server):
+    _, url = server
+    store.root.mkdir()
+    store.path("w.bin.part").write_bytes(DATA[:1000])
+    store.fetch("w.bin", url=url, sha256=DIGEST)
+    assert store.path("w.bin").read_bytes() == DATA
+
+
+def test_truncated_download_is_kept_for_resume(store, server):
+    handler, url = server
+    handler.truncate_to = 1000
+    with pytest.raises(ModelStoreError, match="incomplete"):
+        store.fetch("w.bin", url=url)
+    assert not store.path("w.bin").exists()
+    assert store.path("w.bin.part").read_bytes() == DATA[:1000]
+
+    handler.truncate_to = None
+    store.fetch("w.bin", url=url)
+    assert store.path("w.bin").read_bytes() == DATA
+    assert store.verify("w.bin") == DIGEST
+
+
+def test_complete_part_is_installed_on_416(store, server):
+    _, url = server
+    store.root.mkdir()
+    store.path("w.bin.part").write_bytes(DATA)
+    store.fetch("w.bin", url=url, sha256=DIGEST)
+    assert store.path("w.bin").read_bytes() == DATA
+
+
+def test_oversized_part_restarts_download(store, server):
+    _, url = server
+    store.root.mkdir()
+    store.path("w.bin.part").write_bytes(DATA + b"junk")
+    store.fetch("w.bin", url=url, sha256=DIGEST)
+    assert store.path("w.bin").read_bytes() == DATA
+
+
+def test_ignored_range_restarts_download(store, server):
+    handler, url = server
+    handler.ignore_range = True
+    store.root.mkdir()
+    store.path("w.bin.part").write_bytes(b"stale")
+    store.fetch("w.bin", url=url, sha256=DIGEST)
+    assert store.path("w.bin").read_bytes() == DATA
+
+
+def test_checksum_mismatch_is_not_installed(store, server):
+    _, url = server
+    with pytest.raises(ModelStoreError, match="Checksum mismatch"):
+        store.fetch("w.bin", url=url, sha256="0" * 64)
+    assert not store.path("w.bin").exists()
+    assert not store.path("w.bin.part").exists()
+    assert not store.is_installed("w.bin")
+
+
+def test_failed_validation_is_not_installed(store, server):
+    _, url = server
+
+    def validate(path):
+        raise ValueError("bad weights")
+
+    with pytest.raises(ModelStoreError, match="bad weights"):
+        store.fetch("w.bin", url=url, validate=validate)
+    assert not store.path("w.bin").exists()
+
+
+def test_offline_without_source_raises(tmp_path, server):
+    _, url = server
+    store = ModelStore(root=tmp_path / "store", offline=True)
+    with pytest.raises(ModelStoreError, match="offline"):
+        store.fetch("w.bin", url=url)
+
+
+def test_mirror_install_uses_sidecar(tmp_path):
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    (mirror / "w.bin").write_bytes(DATA)
+    (mirror / "w.bin.sha256").write_text(f"{DIGEST}  w.bin\n")
+    store = ModelStore(root=tmp_path / "store", mirror_dir=mirror, offline=True)
+    store.fetch("w.bin")
+    assert store.verify("w.bin") == DIGEST
+
+
+def test_mirror_with_bad_sidecar_is_rejected(tmp_path):
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    (mirror / "w.bin").write_bytes(DATA)
+    (mirror / "w.bin.sha256").write_text(f"{'1' * 64}  w.bin\n")
+    store = ModelStore(root=tmp_path / "store", mirror_dir=mirror, offline=True)
+    with pytest.raises(ModelStoreError, match="Checksum mismatch"):
+        store.fetch("w.bin")
+    assert not store.path("w.bin").exists()
+
+
+def test_unverified_file_is_reinstalled(store, server):
+    handler, url = server
+    store.root.mkdir()
+    store.path("w.bin").write_bytes(b"legacy")
+    store.fetch("w.bin", url=url, sha256=DIGEST)
+    assert store.path("w.bin").read_bytes() == DATA
+    assert handler.requests == 1
+
+
+def test_unverified_file_is_adopted_if_it_checks_out(store, server):
+    handler, url = server
+    store.root.mkdir()
+    store.path("w.bin").write_bytes(DATA)
+    store.fetch("w.bin", url=url, validate=lambda path: None)
+    assert store.is_installed("w.bin")
+    assert handler.requests == 0
+
+
+def test_unverified_file_is_not_trusted_offline(tmp_path):
+    store = ModelStore(root=tmp_path / "store", offline=True)
+    store.root.mkdir()
+    store.path("w.bin").write_bytes(b"legacy")
+    with pytest.raises(ModelStoreError, match="offline"):
+        store.fetch("w.bin")
+
+
+def test_verify_detects_modified_file(store, server):
+    _, url = server
+    store.fetch("w.bin", url=url)
+    store.path("w.bin").write_bytes(b"tampered")
+    with pytest.raises(ModelStoreError, match="Checksum mismatch"):
+        store.verify("w.bin")
+
+
+def test_concurrent_fetch_downloads_once(store, server):
+    handler, url = server
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        paths = set(pool.map(lambda _: store.fetch("w.bin", url=url, sha256=DIGEST), range(16)))
+    assert paths == {store.path("w.bin")}
+    assert handler.requests == 1
+    assert store.verify("w.bin") == DIGEST
+
+
+def test_forced_reinstall_replaces_file_in_place(store, server):
+    _, url = server
+    store.root.mkdir()
+    store.path("w.bin").write_bytes(b"old")
+    store._write_digest("w.bin", hashlib.sha256(b"old").hexdigest())
+    store.fetch("w.bin", url=url, sha256=DIGEST, force=True)
+    assert store.path("w.bin").read_bytes() == DATA
+    assert store.verify("w.bin") == DIGEST
+
+
+def test_preload_offline_does_not_build(tmp_path):
+    store = ModelStore(root=tmp_path / "store", offline=True)
+    calls = []
+    with pytest.raises(ModelStoreError, match="offline"):
+        store.preload("x.mmap.pt", lambda: calls.append(1) or {})
+    assert calls == []
+    assert not store.path("x.mmap.pt").exists()
+
+
+def test_preload_backbone_offline_without_mirror_raises(tmp_path):
+    store = ModelStore(root=tmp_path / "store", mirror_dir=tmp_path / "empty", offline=True)
+    with pytest.raises(ModelStoreError, match="offline"):
+        store.preload_backbone()
+
+
+@pytest.fixture
+def torch():
+    return pytest.importorskip("torch")
+
+
+@pytest.fixture
+def head_mirror(tmp_path, torch, monkeypatch):
+    # The mirror copy stands in for the upstream file, so ignore any pin
+    monkeypatch.setattr(model_store, "AESTHETIC_HEAD_SHA256", {})
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    return mirror
+
+
+def test_head_install_and_mmap_load(tmp_path, torch, head_mirror):
+    head = torch.nn.Linear(768, 1)
+    torch.save(head.state_dict(), str(head_mirror / "sa_0_4_vit_l_14_linear.pth"))
+    store = ModelStore(root=tmp_path / "store", mirror_dir=head_mirror, offline=True)
+
+    state_dict = store.aesthetic_head_state_dict("vit_l_14")
+    assert store.is_installed("sa_0_4_vit_l_14_linear.pth")
+    assert store.is_installed("sa_0_4_vit_l_14_linear.mmap.pt")
+
+    m = torch.nn.Linear(768, 1)
+    assign_state_dict(m, state_dict)
+    features = torch.randn(2, 768)
+    with torch.no_grad():
+        assert torch.allclose(m(features), head(features))
+
+
+def test_wrong_shape_head_is_rejected(tmp_path, torch, head_mirror):
+    torch.save(torch.nn.Linear(512, 1).state_dict(), str(head_mirror / "sa_0_4_vit_l_14_linear.pth"))
+    store = ModelStore(root=tmp_path / "store", mirror_dir=head_mirror, offline=True)
+    with pytest.raises(ModelStoreError, match="not a valid weight file"):
+        store.aesthetic_head_state_dict("vit_l_14")
+    assert not store.path("sa_0_4_vit_l_14_linear.pth").exists()
+
+
+def test_legacy_head_is_adopted_if_valid(tmp_path, torch, monkeypatch):
+    monkeypatch.setattr(model_store, "AESTHETIC_HEAD_SHA256", {})
+    store = ModelStore(root=tmp_path / "store", offline=True)
+    store.root.mkdir()
+    torch.save(torch.nn.Linear(768, 1).state_dict(), str(store.path("sa_0_4_vit_l_14_linear.pth")))
+    store.aesthetic_head_state_dict("vit_l_14")
+    assert store.is_installed("sa_0_4_vit_l_14_linear.pth")
+
+
+def test_head_preload_works_offline(tmp_path, torch):
+    store = ModelStore(root=tmp_path / "store", offline=True)
+    store.preload("x.mmap.pt", lambda: {"weight": torch.ones(2)}, network=False)
+    assert torch.equal(store.load_state_dict("x.mmap.pt")["weight"], torch.ones(2))
@@ -2,7 +2,12 @@
 
 __version__ = "2.0.0"
 
-from .core import ZenkaiScore
-
 # For convenience, export the main class at the top level
 __all__ = ["ZenkaiScore"]
+
+def __getattr__(name):
+    # Import lazily so torch-free modules like model_store load without torch
+    if name == "ZenkaiScore":
+        from .core import ZenkaiScore
+        return ZenkaiScore
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
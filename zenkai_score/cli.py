@@ -27,6 +27,7 @@ def main():
     # Setup argument
     parser.add_argument("--setup", action="store_true", help="Run first-time setup to download models")
     parser.add_argument("--force", action="store_true", help="Force re-download of model weights during setup")
+    parser.add_argument("--mirror", default=None, help="Local directory to install model weights from during setup")
     
     # Core arguments
     parser.add_argument("path", nargs="?", help="Path to image directory or single image")
@@ -41,7 +42,7 @@ def main():
     # Handle setup if requested
     if args.setup:
         from .setup_utils import setup_zenkai_score
-        setup_zenkai_score(force_download=args.force)
+        setup_zenkai_score(force_download=args.force, mirror_dir=args.mirror)
         return
     
     # Validate that a path was provided for scoring
@@ -1,23 +1,24 @@
-import os
 import torch
 import torch.nn as nn
-from os.path import expanduser
-from urllib.request import urlretrieve
 from PIL import Image
 from pathlib import Path
 from typing import List, Tuple, Dict, Union, Optional, Callable
 import sys
 
+from .model_store import ModelStore, assign_state_dict
+
 class ZenkaiScore:
     """Core engine for Zenkai-Score aesthetic image scoring system"""
     
-    def __init__(self, device: Optional[str] = None):
+    def __init__(self, device: Optional[str] = None, model_store: Optional[ModelStore] = None):
         """Initialize the Zenkai-Score engine
         
         Args:
             device: Device to run inference on ('cpu', 'cuda', etc.)
+            model_store: Store to load weights from, defaults to the shared local store
         """
         self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model_store = model_store or ModelStore()
         self.image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'}
         
         # Load aesthetic model
@@ -26,10 +27,19 @@ class ZenkaiScore:
         # Load CLIP model
         try:
             import open_clip
-            self.model, _, self.preprocess = open_clip.create_model_and_transforms('ViT-L-14', pretrained='openai')
         except ImportError:
             print("Error: open_clip not available. Please install with 'pip install open-clip-torch'")
             sys.exit(1)
+        
+        # Backbone weights go through the store, which preloads them once under
+        # a lock and memory-maps them so worker processes share pages
+        try:
+            self.model, self.preprocess = self.model_store.load_backbone('ViT-L-14', 'openai')
+        except Exception as e:
+            print(f"Error loading CLIP model: {e}")
+            if self.model_store.offline:
+                print("Run 'python -m zenkai_score --setup --mirror <dir>' to install the weights offline.")
+            sys.exit(1)
     
     def get_aesthetic_model(self, clip_model="vit_l_14"):
         """Load the aesthetic model following the notebook approach
@@ -40,25 +50,6 @@ class ZenkaiScore:
         Returns:
             Loaded aesthetic model
         """
-        home = expanduser("~")
-        cache_folder = home + "/.cache/emb_reader"
-        path_to_model = cache_folder + "/sa_0_4_"+clip_model+"_linear.pth"
-        
-        if not os.path.exists(path_to_model):
-            os.makedirs(cache_folder, exist_ok=True)
-            url_model = (
-                "https://github.com/LAION-AI/aesthetic-predictor/blob/main/sa_0_4_"+clip_model+"_linear.pth?raw=true"
-            )
-            print(f"Downloading model from {url_model} to {path_to_model}")
-            urlretrieve(url_model, path_to_model)
-        
-        # Check if file exists and has content
-        if os.path.exists(path_to_model):
-            file_size = os.path.getsize(path_to_model)
-            print(f"Model file exists, size: {file_size} bytes")
-        else:
-            print(f"Error: Model file does not exist at {path_to_model}")
-            
         if clip_model == "vit_l_14":
             m = nn.Linear(768, 1)
         elif clip_model == "vit_b_32":
@@ -67,8 +58,8 @@ class ZenkaiScore:
             raise ValueError(f"Unsupported clip model: {clip_model}")
         
         try:
-            s = torch.load(path_to_model, weights_only=True)
-            m.load_state_dict(s)
+            s = self.model_store.aesthetic_head_state_dict(clip_model)
+            assign_state_dict(m, s)
             m.eval()
         except Exception as e:
             print(f"Error loading model: {e}")
@@ -0,0 +1,550 @@
+"""Shared local store for Zenkai-Score model weights
+
+All weight files live in a single cache directory (``~/.cache/emb_reader`` by
+default). Installs are lock-protected, checksum-verified and atomic, so a
+partially written file is never visible under its final name and concurrent
+workers never race on the same download.
+
+Environment variables:
+    ZENKAI_CACHE_DIR: Override the store directory
+    ZENKAI_MODEL_MIRROR: Local directory to install weights from instead of the network
+    ZENKAI_OFFLINE: Set to 1 to forbid network downloads
+"""
+
+import hashlib
+import inspect
+import os
+import shutil
+import sys
+import time
+from os.path import expanduser
+from pathlib import Path
+from http.client import HTTPException
+from typing import Callable, Dict, Optional, Tuple, Union
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+DEFAULT_CACHE_DIR = os.path.join(expanduser("~"), ".cache", "emb_reader")
+
+AESTHETIC_HEAD_URL = (
+    "https://github.com/LAION-AI/aesthetic-predictor/blob/main/sa_0_4_{clip_model}_linear.pth?raw=true"
+)
+
+# Pinned SHA-256 digests of the upstream head weights, keyed by clip model.
+# Files without a pin are checked against a mirror's ``.sha256`` sidecar if
+# one exists, and head files are always checked to load as a linear layer of
+# the expected shape before they are installed.
+# TODO: pin the digests of the upstream vit_l_14 and vit_b_32 head files
+AESTHETIC_HEAD_SHA256: Dict[str, str] = {}
+
+AESTHETIC_HEAD_FEATURES = {"vit_l_14": 768, "vit_b_32": 512}
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class ModelStoreError(RuntimeError):
+    """Raised when model weights cannot be installed or verified"""
+
+
+class _FileLock:
+    """Exclusive inter-process lock backed by a lock file"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
+        if sys.platform == "win32":
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 seconds, keep waiting
+                    time.sleep(1)
+        else:
+            import fcntl
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fsync(path: Path) -> None:
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _read_digest(path: Path) -> Optional[str]:
+    """Read a digest from a ``sha256sum``-style sidecar file"""
+    if not path.exists():
+        return None
+    content = path.read_text().split()
+    return content[0].lower() if content else None
+
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """Parse ``bytes start-end/total`` or ``bytes */total`` into (start, total)"""
+    if not value:
+        return None, None
+    try:
+        span, total = value.split()[-1].split("/")
+        start = None if span == "*" else int(span.split("-")[0])
+        return start, None if total == "*" else int(total)
+    except ValueError:
+        return None, None
+
+
+def _accepts(func, name: str) -> bool:
+    try:
+        return name in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _torch_load(path: Path, mmap: bool = False):
+    """Safely load a state dict onto CPU, memory-mapping it when torch supports it"""
+    import torch
+
+    if not _accepts(torch.load, "weights_only"):
+        # Never unpickle downloaded or mirrored files with a full pickle load
+        raise ModelStoreError(
+            f"torch {torch.__version__} cannot load {path} safely, torch >= 1.13 is required"
+        )
+    kwargs = {"map_location": "cpu", "weights_only": True}
+    if mmap and _accepts(torch.load, "mmap"):
+        kwargs["mmap"] = True
+    return torch.load(str(path), **kwargs)
+
+
+def _shape_validator(expected_shapes: Callable[[], Dict[str, tuple]]) -> Callable[[Path], None]:
+    """Build a check that a file holds a state dict with exactly the expected tensor shapes"""
+    def validate(path: Path) -> None:
+        shapes = {key: tuple(value.shape) for key, value in _torch_load(path).items()}
+        expected = expected_shapes()
+        if shapes != expected:
+            missing = sorted(set(expected) - set(shapes))
+            unexpected = sorted(set(shapes) - set(expected))
+            mismatched = sorted(key for key in expected if key in shapes and shapes[key] != expected[key])
+            raise ModelStoreError(
+                f"state dict does not match the model (missing {missing[:5]}, "
+                f"unexpected {unexpected[:5]}, wrong shape {mismatched[:5]})"
+            )
+    return validate
+
+
+def _linear_head_validator(in_features: int) -> Callable[[Path], None]:
+    """Build a check that a file holds an ``nn.Linear(in_features, 1)`` state dict"""
+    return _shape_validator(lambda: {"weight": (1, in_features), "bias": (1,)})
+
+
+def _create_backbone(model_name: str, pretrained: str):
+    """Create an OpenCLIP model and its transforms without loading any weights"""
+    import open_clip
+
+    # OpenAI weights were trained with QuickGELU
+    kwargs = {"force_quick_gelu": True} if pretrained == "openai" else {}
+    model, _, preprocess = open_clip.create_model_and_transforms(model_name, pretrained=None, **kwargs)
+    return model, preprocess
+
+
+def _backbone_validator(model_name: str, pretrained: str) -> Callable[[Path], None]:
+    """Build a check that a file holds weights for the given OpenCLIP architecture"""
+    def expected_shapes() -> Dict[str, tuple]:
+        model, _ = _create_backbone(model_name, pretrained)
+        return {key: tuple(value.shape) for key, value in model.state_dict().items()}
+    return _shape_validator(expected_shapes)
+
+
+def assign_state_dict(module, state_dict) -> None:
+    """Load a state dict into a module, sharing memory-mapped storage if possible
+
+    Args:
+        module: Target torch module
+        state_dict: State dict, typically from ModelStore.load_state_dict
+    """
+    if _accepts(module.load_state_dict, "assign"):
+        module.load_state_dict(state_dict, assign=True)
+    else:
+        # torch < 2.1 has no assign=, fall back to copying the weights
+        module.load_state_dict(state_dict)
+
+
+class ModelStore:
+    """Local directory of verified model weight files shared by all workers"""
+
+    def __init__(self,
+                 root: Optional[Union[str, Path]] = None,
+                 mirror_dir: Optional[Union[str, Path]] = None,
+                 offline: Optional[bool] = None):
+        """Initialize the model store
+
+        Args:
+            root: Store directory, defaults to $ZENKAI_CACHE_DIR or ~/.cache/emb_reader
+            mirror_dir: Directory to install weights from, defaults to $ZENKAI_MODEL_MIRROR
+            offline: Forbid network downloads, defaults to $ZENKAI_OFFLINE
+        """
+        self.root = Path(root or os.environ.get("ZENKAI_CACHE_DIR") or DEFAULT_CACHE_DIR)
+        mirror_dir = mirror_dir or os.environ.get("ZENKAI_MODEL_MIRROR")
+        self.mirror_dir = Path(mirror_dir) if mirror_dir else None
+        self.offline = _env_flag("ZENKAI_OFFLINE") if offline is None else offline
+
+    def path(self, filename: str) -> Path:
+        """Return the installed location of a file in the store"""
+        return self.root / filename
+
+    def is_installed(self, filename: str) -> bool:
+        """Whether a file was completely installed by the store
+
+        The digest sidecar is written right after the final rename, so a file
+        without one is a leftover from an interrupted or legacy install.
+        """
+        return self.path(filename).exists() and self._digest_path(filename).exists()
+
+    def _lock(self, filename: str) -> _FileLock:
+        self.root.mkdir(parents=True, exist_ok=True)
+        return _FileLock(self.root / (filename + ".lock"))
+
+    def _digest_path(self, filename: str) -> Path:
+        return self.root / (filename + ".sha256")
+
+    def _write_digest(self, filename: str, digest: str) -> None:
+        sidecar = self._digest_path(filename)
+        tmp = sidecar.with_name(sidecar.name + ".part")
+        tmp.write_text(f"{digest}  {filename}\n")
+        os.replace(str(tmp), str(sidecar))
+
+    def _mirror_file(self, filename: str) -> Optional[Path]:
+        if self.mirror_dir is None:
+            return None
+        source = self.mirror_dir / filename
+        return source if source.is_file() else None
+
+    def _check(self,
+               filename: str,
+               path: Path,
+               expected: Optional[str],
+               validate: Optional[Callable[[Path], None]]) -> str:
+        """Check a file against its expected digest and validator, returning its digest"""
+        digest = _sha256(path)
+        if expected and digest != expected.lower():
+            raise ModelStoreError(
+                f"Checksum mismatch for {filename}: expected {expected}, got {digest}"
+            )
+        if validate is not None:
+            try:
+                validate(path)
+            except Exception as e:
+                raise ModelStoreError(f"{filename} is not a valid weight file: {e}") from e
+        return digest
+
+    def _adopt(self,
+               filename: str,
+               expected: Optional[str],
+               validate: Optional[Callable[[Path], None]]) -> bool:
+        """Record an existing file without a digest sidecar if it checks out"""
+        if expected is None and validate is None:
+            return False
+        try:
+            digest = self._check(filename, self.path(filename), expected, validate)
+        except ModelStoreError as e:
+            print(f"Reinstalling unverified {filename}: {e}")
+            return False
+        self._write_digest(filename, digest)
+        return True
+
+    def _install(self,
+                 filename: str,
+                 part: Path,
+                 expected: Optional[str],
+                 validate: Optional[Callable[[Path], None]] = None) -> Path:
+        """Verify a fully written ``.part`` file and atomically move it into place"""
+        try:
+            digest = self._check(filename, part, expected, validate)
+        except ModelStoreError:
+            part.unlink()
+            raise
+        _fsync(part)
+        target = self.path(filename)
+        # Readers always see the old or the new file. Dropping the old digest
+        # first means a crash before the new one is written leaves a file
+        # without a sidecar, which the next fetch revalidates.
+        sidecar = self._digest_path(filename)
+        if sidecar.exists():
+            sidecar.unlink()
+        os.replace(str(part), str(target))
+        self._write_digest(filename, digest)
+        return target
+
+    def _download(self, url: str, part: Path, restart: bool = True) -> None:
+        """Download url into part, resuming from any bytes already present"""
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            response = urlopen(Request(url, headers=headers), timeout=60)
+        except HTTPError as e:
+            if e.code == 416 and offset:
+                if _content_range(e.headers.get("Content-Range"))[1] == offset:
+                    return
+                # The partial file does not match the remote file, start over
+                part.unlink()
+                if restart:
+                    return self._download(url, part, restart=False)
+            raise ModelStoreError(f"Failed to download {url}: {e}") from e
+        except URLError as e:
+            raise ModelStoreError(f"Failed to download {url}: {e}") from e
+
+        with response:
+            length = response.headers.get("Content-Length")
+            if offset and response.getcode() == 206:
+                start, total = _content_range(response.headers.get("Content-Range"))
+                if start != offset:
+                    raise ModelStoreError(f"Server resumed {url} at byte {start}, expected {offset}")
+                if total is None and length is not None:
+                    total = offset + int(length)
+                mode = "ab"
+                print(f"Resuming download of {url} at byte {offset}")
+            else:
+                # A 200 means the server ignored the range, start over
+                offset = 0
+                total = int(length) if length is not None else None
+                mode = "wb"
+
+            received = offset
+            try:
+                with open(part, mode) as f:
+                    for chunk in iter(lambda: response.read(_CHUNK_SIZE), b""):
+                        f.write(chunk)
+                        received += len(chunk)
+            except (OSError, HTTPException) as e:
+                raise ModelStoreError(f"Download of {url} interrupted, rerun to resume: {e}") from e
+
+        # A short body is not an error to urllib, the .part is kept for resuming
+        if total is not None and received != total:
+            raise ModelStoreError(
+                f"Download of {url} incomplete ({received} of {total} bytes), rerun to resume"
+            )
+
+    def fetch(self,
+              filename: str,
+              url: Optional[str] = None,
+              sha256: Optional[str] = None,
+              force: bool = False,
+              validate: Optional[Callable[[Path], None]] = None) -> Path:
+        """Ensure a verified copy of a file is installed in the store
+
+        Args:
+            filename: Name of the file in the store
+            url: Upstream URL to download from when no mirror copy exists
+            sha256: Expected SHA-256 digest
+            force: Reinstall even if the file is already present
+            validate: Optional check of the file contents, raising on failure
+
+        Returns:
+            Path to the installed file
+        """
+        target = self.path(filename)
+        if not force and self.is_installed(filename):
+            return target
+
+        with self._lock(filename):
+            # Another worker may have finished the install while we waited
+            if not force and self.is_installed(filename):
+                return target
+
+            part = target.with_name(filename + ".part")
+            source = self._mirror_file(filename)
+            if source is not None:
+                expected = sha256 or _read_digest(source.with_name(filename + ".sha256"))
+            else:
+                expected = sha256
+
+            # Files left by an interrupted or legacy install are only kept if they check out
+            if not force and target.exists() and self._adopt(filename, expected, validate):
+                return target
+
+            if source is not None:
+                print(f"Installing {filename} from mirror {self.mirror_dir}")
+                shutil.copyfile(str(source), str(part))
+            elif self.offline:
+                raise ModelStoreError(
+                    f"{filename} is not installed in {self.root} and offline mode is enabled"
+                )
+            elif url is None:
+                raise ModelStoreError(f"No download source for {filename}")
+            else:
+                # A forced reinstall accepts a new upstream file unless pinned
+                expected = sha256 or (None if force else _read_digest(self._digest_path(filename)))
+                if expected is None:
+                    print(f"Warning: no pinned checksum for {filename}, it will not be verified against a trusted digest")
+                if force and part.exists():
+                    part.unlink()
+                print(f"Downloading model from {url} to {target}")
+                self._download(url, part)
+
+            return self._install(filename, part, expected, validate)
+
+    def verify(self, filename: str, sha256: Optional[str] = None) -> str:
+        """Check an installed file against its expected or recorded digest
+
+        Args:
+            filename: Name of the file in the store
+            sha256: Expected SHA-256 digest, defaults to the recorded one
+
+        Returns:
+            The file's SHA-256 digest
+        """
+        target = self.path(filename)
+        if not target.exists():
+            raise ModelStoreError(f"{filename} is not installed in {self.root}")
+        expected = sha256 or _read_digest(self._digest_path(filename))
+        digest = _sha256(target)
+        if expected and digest != expected.lower():
+            raise ModelStoreError(
+                f"Checksum mismatch for {target}: expected {expected}, got {digest}"
+            )
+        return digest
+
+    def preload(self,
+                filename: str,
+                build_state_dict: Callable[[], dict],
+                force: bool = False,
+                network: bool = True,
+                validate: Optional[Callable[[Path], None]] = None) -> Path:
+        """Install a state dict as a memory-mappable file
+
+        A copy in the mirror directory is preferred over building one.
+
+        Args:
+            filename: Name of the file in the store
+            build_state_dict: Callable producing the state dict to save
+            force: Rebuild even if the file is already present
+            network: Whether build_state_dict may download, which offline mode forbids
+            validate: Optional check of a mirrored copy, raising on failure
+
+        Returns:
+            Path to the installed file
+        """
+        if self._mirror_file(filename) is not None:
+            return self.fetch(filename, force=force, validate=validate)
+
+        target = self.path(filename)
+        if not force and self.is_installed(filename):
+            return target
+
+        with self._lock(filename):
+            if not force and self.is_installed(filename):
+                return target
+
+            if network and self.offline:
+                raise ModelStoreError(
+                    f"{filename} is not installed in {self.root} or the mirror and offline mode is enabled"
+                )
+
+            import torch
+
+            part = target.with_name(filename + ".part")
+            # torch.save's zip format stores tensors uncompressed and aligned,
+            # which is what torch.load(mmap=True) requires
+            torch.save(build_state_dict(), str(part))
+            return self._install(filename, part, None)
+
+    def load_state_dict(self, filename: str) -> dict:
+        """Memory-map a preloaded state dict so processes share its pages"""
+        target = self.path(filename)
+        if not target.exists():
+            raise ModelStoreError(f"{filename} is not installed in {self.root}")
+        return _torch_load(target, mmap=True)
+
+    def aesthetic_head_state_dict(self, clip_model: str = "vit_l_14", force: bool = False) -> dict:
+        """Install the LAION aesthetic head and return its memory-mapped weights
+
+        Args:
+            clip_model: CLIP model variant the head was trained on
+            force: Reinstall even if the weights are already present
+
+        Returns:
+            State dict for the aesthetic head
+        """
+        raw_name = f"sa_0_4_{clip_model}_linear.pth"
+        raw_path = self.fetch(
+            raw_name,
+            url=AESTHETIC_HEAD_URL.format(clip_model=clip_model),
+            sha256=AESTHETIC_HEAD_SHA256.get(clip_model),
+            force=force,
+            validate=_linear_head_validator(AESTHETIC_HEAD_FEATURES[clip_model]),
+        )
+        mapped_name = f"sa_0_4_{clip_model}_linear.mmap.pt"
+        self.preload(mapped_name, lambda: _torch_load(raw_path), force=force, network=False)
+        return self.load_state_dict(mapped_name)
+
+    @staticmethod
+    def backbone_filename(model_name: str, pretrained: str) -> str:
+        return f"open_clip_{model_name}_{pretrained}.mmap.pt"
+
+    def preload_backbone(self,
+                         model_name: str = "ViT-L-14",
+                         pretrained: str = "openai",
+                         force: bool = False) -> Path:
+        """Install the CLIP backbone weights as a memory-mappable file
+
+        Args:
+            model_name: OpenCLIP model architecture
+            pretrained: OpenCLIP pretrained tag
+            force: Rebuild even if the weights are already present
+
+        Returns:
+            Path to the installed file
+        """
+        def build():
+            import open_clip
+            model, _, _ = open_clip.create_model_and_transforms(model_name, pretrained=pretrained)
+            return model.state_dict()
+
+        return self.preload(
+            self.backbone_filename(model_name, pretrained),
+            build,
+            force=force,
+            validate=_backbone_validator(model_name, pretrained),
+        )
+
+    def load_backbone(self, model_name: str = "ViT-L-14", pretrained: str = "openai"):
+        """Preload the CLIP backbone if needed and build it on memory-mapped weights
+
+        Args:
+            model_name: OpenCLIP model architecture
+            pretrained: OpenCLIP pretrained tag
+
+        Returns:
+            Tuple of (model, preprocess transform)
+        """
+        filename = self.backbone_filename(model_name, pretrained)
+        self.preload_backbone(model_name, pretrained)
+        model, preprocess = _create_backbone(model_name, pretrained)
+        assign_state_dict(model, self.load_state_dict(filename))
+        return model, preprocess
@@ -1,18 +1,19 @@
 import os
 import sys
 from pathlib import Path
-from urllib.request import urlretrieve
-import shutil
+from typing import Optional
 
-def setup_zenkai_score(force_download: bool = False) -> None:
+from .model_store import ModelStore
+
+def setup_zenkai_score(force_download: bool = False, mirror_dir: Optional[str] = None) -> None:
     """Set up Zenkai-Score for first use
     
     Args:
         force_download: Force re-download even if files exist
+        mirror_dir: Local directory to install weights from instead of downloading
     """
-    # Cache directory
-    from os.path import expanduser
-    cache_dir = expanduser("~/.cache/emb_reader")
+    store = ModelStore(mirror_dir=mirror_dir)
+    cache_dir = store.root
     
     print(f"Setting up Zenkai-Score V2.0 in {cache_dir}...")
     os.makedirs(cache_dir, exist_ok=True)
@@ -40,33 +41,31 @@ def setup_zenkai_score(force_download: bool = False) -> None:
         print("OpenCLIP not installed. Please install: pip install open-clip-torch")
         return
     
-    # Download model weights
+    # Install and verify the aesthetic head weights
     model_name = "vit_l_14"
-    output_path = os.path.join(cache_dir, f"sa_0_4_{model_name}_linear.pth")
-    url = f"https://github.com/LAION-AI/aesthetic-predictor/blob/main/sa_0_4_{model_name}_linear.pth?raw=true"
-    
-    download_needed = force_download or not os.path.exists(output_path)
+    try:
+        state_dict = store.aesthetic_head_state_dict(model_name, force=force_download)
+        digest = store.verify(f"sa_0_4_{model_name}_linear.pth")
+        print(f"Model weights verified at {store.path(f'sa_0_4_{model_name}_linear.pth')} (sha256 {digest})")
+    except Exception as e:
+        print(f"Failed to install model weights: {e}")
+        return
     
-    if download_needed:
-        print(f"Downloading model weights...")
-        try:
-            print(f"Downloading from {url} to {output_path}")
-            urlretrieve(url, output_path)
-            print("Download completed successfully")
-        except Exception as e:
-            print(f"Failed to download model weights: {e}")
-            return
-    else:
-        print(f"Model weights already exist at {output_path}")
+    # Preload the CLIP backbone so workers can memory-map it
+    try:
+        print("Preloading CLIP backbone weights...")
+        backbone_path = store.preload_backbone("ViT-L-14", "openai", force=force_download)
+        print(f"CLIP backbone weights stored at {backbone_path}")
+    except Exception as e:
+        print(f"Failed to preload CLIP backbone weights: {e}")
+        return
     
     # Test loading model to verify
     try:
-        import torch
         import torch.nn as nn
         
-        s = torch.load(output_path)
         m = nn.Linear(768, 1)
-        m.load_state_dict(s)
+        m.load_state_dict(state_dict)
         print("Model loaded successfully!")
     except Exception as e:
         print(f"Error loading model: {e}")
@@ -81,9 +80,10 @@ def main():
     import argparse
     parser = argparse.ArgumentParser(description="Zenkai-Score V2.0 Setup")
     parser.add_argument("--force", action="store_true", help="Force re-download of model weights")
+    parser.add_argument("--mirror", default=None, help="Local directory to install model weights from")
     args = parser.parse_args()
     
-    setup_zenkai_score(force_download=args.force)
+    setup_zenkai_score(force_download=args.force, mirror_dir=args.mirror)
 
 if __name__ == "__main__":
     main()